@@ -17,7 +17,7 @@ export async function POST(request: NextRequest) {
     const mlServiceUrl = process.env.ML_SERVICE_URL || 'http://localhost:8002'
     
     try {
-      const mlResponse = await fetch(`${mlServiceUrl}/predict`, {
+      const mlResponse = await fetch(`${mlServiceUrl}/predict_v1`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
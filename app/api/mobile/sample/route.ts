@@ -55,7 +55,7 @@ export async function POST(request: NextRequest) {
     // Get ML predictions
     let predictions = null
     try {
-      const mlResponse = await fetch(`${process.env.ML_SERVICE_URL}/predict`, {
+      const mlResponse = await fetch(`${process.env.ML_SERVICE_URL}/predict_v1`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
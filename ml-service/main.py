@@ -1,12 +1,22 @@
+import os
+
+# One compute thread per process: requests are already batched and the service
+# scales out with worker processes, so nested BLAS/OpenMP pools only oversubscribe.
+# Must be set before numpy / scikit-learn are imported.
+for _var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(_var, '1')
+
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 import numpy as np
 import joblib
 import logging
-import os
+import asyncio
 from datetime import datetime
 from contextlib import asynccontextmanager
+from collections import OrderedDict
 from typing import List, Dict
 
 # Configure logging
@@ -15,55 +25,280 @@ logger = logging.getLogger(__name__)
 
 # Global model variables
 classifier_model = None
+classifier_session = None
+classifier_input_name = None
+classifier_output_name = None
+onnx_includes_scaler = False
 feature_scaler = None
 label_encoder = None
 feature_names_list = None
 model_metadata = None
 
+# Constants derived from the loaded artifacts (set once in load_models)
+n_features = 47
+fresh_class_idx = 1
+spoiled_class_idx = 0
+model_accuracy = 0.95
+top_feature_names = []
+top_feature_weights = None
+scaler_mean = None
+scaler_inv_scale = None
+
+# Micro-batching: requests are queued and scored together in one model call
+MAX_BATCH = 64
+BATCH_WAIT_SECONDS = 0.005
+prediction_queue = None
+batch_worker_task = None
+feature_buffer = None
+
+# LRU cache of results for near-duplicate readings, keyed by the feature vector
+# rounded to 3 decimals
+PREDICTION_CACHE_SIZE = 8192
+prediction_cache = OrderedDict()
+cache_hits = 0
+cache_misses = 0
+
 def load_models():
     """Load trained models and preprocessing objects"""
-    global classifier_model, feature_scaler, label_encoder, feature_names_list, model_metadata
+    global classifier_model, classifier_session, classifier_input_name, classifier_output_name, onnx_includes_scaler
+    global feature_scaler, label_encoder, feature_names_list, model_metadata, feature_buffer
+    global n_features, fresh_class_idx, spoiled_class_idx, model_accuracy
+    global top_feature_names, top_feature_weights, scaler_mean, scaler_inv_scale
     
     try:
-        # Load the trained classifier
-        if os.path.exists('models/lacteva_classifier.joblib'):
-            classifier_model = joblib.load('models/lacteva_classifier.joblib')
-            logger.info("✓ Loaded trained classifier")
+        # Artifacts are memory-mapped (mmap_mode='r') so that multiple workers
+        # share their numpy arrays through the OS page cache
+        
+        # Load feature names first, the other artifacts are checked against them
+        if os.path.exists('models/feature_names.joblib'):
+            feature_names_list = joblib.load('models/feature_names.joblib', mmap_mode='r')
+            logger.info(f"✓ Loaded {len(feature_names_list)} feature names")
+        expected_features = len(feature_names_list) if feature_names_list else None
         
-        # Load scaler
-        if os.path.exists('models/scaler.joblib'):
-            feature_scaler = joblib.load('models/scaler.joblib')
-            logger.info("✓ Loaded feature scaler")
+        # Load scaler + classifier, preferably from the single pipeline artifact.
+        # A pipeline left behind by an older training run is skipped when its
+        # feature count no longer matches feature_names
+        pipeline = None
+        if os.path.exists('models/pipeline.joblib'):
+            pipeline = joblib.load('models/pipeline.joblib', mmap_mode='r')
+            pipeline_features = getattr(pipeline, 'n_features_in_', None)
+            if expected_features is not None and pipeline_features not in (None, expected_features):
+                logger.warning(f"Ignoring stale models/pipeline.joblib ({pipeline_features} features, "
+                               f"expected {expected_features})")
+                pipeline = None
+        
+        if pipeline is not None:
+            feature_scaler = pipeline.named_steps['scaler']
+            classifier_model = pipeline.named_steps['clf']
+            logger.info("✓ Loaded scaler + classifier pipeline")
+        else:
+            # Load the trained classifier
+            if os.path.exists('models/lacteva_classifier.joblib'):
+                classifier_model = joblib.load('models/lacteva_classifier.joblib', mmap_mode='r')
+                logger.info("✓ Loaded trained classifier")
+            
+            # Load scaler
+            if os.path.exists('models/scaler.joblib'):
+                feature_scaler = joblib.load('models/scaler.joblib', mmap_mode='r')
+                logger.info("✓ Loaded feature scaler")
+        
+        # Predict-time joblib parallelism only costs at these batch sizes
+        if hasattr(classifier_model, 'n_jobs'):
+            classifier_model.n_jobs = 1
+        
+        # Prefer an ONNX export for inference; the pipeline graph also does the scaling
+        for onnx_path, includes_scaler in [('models/lacteva_pipeline.onnx', True),
+                                           ('models/lacteva_classifier.onnx', False)]:
+            if not os.path.exists(onnx_path):
+                continue
+            try:
+                import onnxruntime as ort
+                session_options = ort.SessionOptions()
+                session_options.intra_op_num_threads = 1
+                session_options.inter_op_num_threads = 1
+                session = ort.InferenceSession(
+                    onnx_path,
+                    sess_options=session_options,
+                    providers=['CPUExecutionProvider']
+                )
+                onnx_features = session.get_inputs()[0].shape[-1]
+                if expected_features is not None and isinstance(onnx_features, int) and onnx_features != expected_features:
+                    logger.warning(f"Ignoring stale {onnx_path} ({onnx_features} features, "
+                                   f"expected {expected_features})")
+                    continue
+                classifier_session = session
+                classifier_input_name = classifier_session.get_inputs()[0].name
+                # Outputs are (label, probabilities) since zipmap is disabled at export
+                classifier_output_name = classifier_session.get_outputs()[1].name
+                onnx_includes_scaler = includes_scaler
+                logger.info(f"✓ Loaded ONNX model from {onnx_path}")
+            except ImportError:
+                logger.warning("onnxruntime not available - using joblib classifier")
+            break
         
         # Load label encoder
         if os.path.exists('models/label_encoder.joblib'):
-            label_encoder = joblib.load('models/label_encoder.joblib')
+            label_encoder = joblib.load('models/label_encoder.joblib', mmap_mode='r')
             logger.info("✓ Loaded label encoder")
         
-        # Load feature names
-        if os.path.exists('models/feature_names.joblib'):
-            feature_names_list = joblib.load('models/feature_names.joblib')
-            logger.info(f"✓ Loaded {len(feature_names_list)} feature names")
-        
         # Load model metadata
         if os.path.exists('models/model_metadata.joblib'):
-            model_metadata = joblib.load('models/model_metadata.joblib')
+            model_metadata = joblib.load('models/model_metadata.joblib', mmap_mode='r')
             logger.info(f"✓ Model accuracy: {model_metadata.get('accuracy', 'N/A')}")
             
     except Exception as e:
         logger.error(f"Error loading models: {e}")
+    
+    # Resolve per-request constants once instead of on every prediction
+    n_features = len(feature_names_list) if feature_names_list else 47
+    model_accuracy = float(model_metadata.get('accuracy', 0.95)) if model_metadata else 0.95
+    if label_encoder is not None:
+        classes = list(label_encoder.classes_)
+        fresh_class_idx = classes.index('fresh') if 'fresh' in classes else 1
+        spoiled_class_idx = classes.index('Spoiled') if 'Spoiled' in classes else 0
+    
+    # StandardScaler reduced to float32 constants: transform is (x - mean) * (1 / scale)
+    if feature_scaler is not None:
+        mean = feature_scaler.mean_ if feature_scaler.mean_ is not None else np.zeros(n_features)
+        scale = feature_scaler.scale_ if feature_scaler.scale_ is not None else np.ones(n_features)
+        scaler_mean = np.asarray(mean, dtype=np.float32)
+        scaler_inv_scale = (1.0 / np.asarray(scale, dtype=np.float64)).astype(np.float32)
+    
+    # Reported feature importance covers the first 10 features, weighted by the
+    # model's learned importances when it exposes them
+    if feature_names_list:
+        top_feature_names = list(feature_names_list[:10])
+        importances = getattr(classifier_model, 'feature_importances_', None)
+        if importances is not None:
+            top_feature_weights = np.asarray(importances[:10], dtype=np.float64)
+        else:
+            top_feature_weights = np.ones(len(top_feature_names))
+    
+    # Reusable float32 input buffer for the batch worker
+    feature_buffer = np.empty((MAX_BATCH, n_features), dtype=np.float32)
+
+def predict_probabilities(features_scaled):
+    """Return class probabilities for a float32 batch prepared by score_features"""
+    if classifier_session is not None:
+        return classifier_session.run(
+            [classifier_output_name], {classifier_input_name: features_scaled}
+        )[0]
+    
+    return classifier_model.predict_proba(features_scaled)
+
+def score_features(features):
+    """Clean, scale and classify a float32 feature matrix (in place) and build one MLOutput per row"""
+    # Handle NaN and inf values; sensor rows are almost always clean, so only
+    # rewrite the buffer when something is actually non-finite
+    if not np.isfinite(features).all():
+        np.nan_to_num(features, copy=False, nan=0.0, posinf=1e6, neginf=-1e6)
+    
+    # Keep the unscaled values needed for feature importance
+    top_values = np.abs(features[:, :len(top_feature_names)])
+    
+    # Scale features in place, bypassing StandardScaler's per-call validation
+    # (the ONNX pipeline graph scales internally)
+    if not onnx_includes_scaler:
+        np.subtract(features, scaler_mean, out=features)
+        np.multiply(features, scaler_inv_scale, out=features)
+    features_scaled = features
+    
+    # predict() would traverse the forest again; argmax of the
+    # probabilities gives the same class index
+    probabilities = predict_probabilities(features_scaled)
+    predictions = probabilities.argmax(axis=1)
+    
+    # Calculate freshness score and shelf life based on model output
+    is_fresh = predictions == fresh_class_idx
+    fresh_prob = probabilities[:, fresh_class_idx]
+    spoiled_prob = probabilities[:, spoiled_class_idx]
+    freshness_scores = np.where(is_fresh, 0.7 + fresh_prob * 0.3, spoiled_prob * 0.3)  # 0.7-1.0 fresh, 0.0-0.3 spoiled
+    shelf_life_hours = np.where(is_fresh, 48 + fresh_prob * 24, spoiled_prob * 12)    # 48-72h fresh, 0-12h spoiled
+    
+    # Get confidence (highest probability)
+    confidences = probabilities.max(axis=1)
+    
+    # Feature importance: |value| scaled by model importance, top 10 features only
+    if top_feature_names:
+        weighted = top_values * top_feature_weights
+        weighted /= weighted.sum(axis=1, keepdims=True) + 1e-6
+        feature_importances = [dict(zip(top_feature_names, row)) for row in weighted.tolist()]
+    else:
+        feature_importances = [{} for _ in range(len(probabilities))]
+    
+    # Values are produced here, so skip re-validating them
+    return [
+        MLOutput.model_construct(
+            freshness_prediction=float(freshness_scores[i]),
+            shelf_life_hours=float(shelf_life_hours[i]),
+            confidence=float(confidences[i]),
+            model_accuracy=model_accuracy,
+            prediction_label='fresh' if is_fresh[i] else 'spoiled',
+            feature_importance=feature_importances[i]
+        )
+        for i in range(len(probabilities))
+    ]
+
+async def batch_worker():
+    """Drain queued prediction requests and score them in a single model call"""
+    loop = asyncio.get_running_loop()
+    
+    while True:
+        # Block until the first request arrives, then collect more until the
+        # batch is full or the wait window closes
+        batch = [await prediction_queue.get()]
+        deadline = loop.time() + BATCH_WAIT_SECONDS
+        
+        while len(batch) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(prediction_queue.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        try:
+            # Fill the preallocated buffer instead of building a new array
+            features = feature_buffer[:len(batch)]
+            for i, (row, _) in enumerate(batch):
+                features[i] = row
+            
+            outputs = score_features(features)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        
+        for (_, future), output in zip(batch, outputs):
+            # The caller may have gone away (e.g. client disconnect)
+            if not future.done():
+                future.set_result(output)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize models on startup"""
+    """Initialize models and the batch worker on startup"""
+    global prediction_queue, batch_worker_task
+    
     load_models()
+    prediction_cache.clear()
+    prediction_queue = asyncio.Queue()
+    batch_worker_task = asyncio.create_task(batch_worker())
     yield
+    
+    batch_worker_task.cancel()
+    try:
+        await batch_worker_task
+    except asyncio.CancelledError:
+        pass
 
 app = FastAPI(
     title="LACTEVA ML Service",
     description="Machine Learning service for milk quality prediction with real datasets",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -81,6 +316,9 @@ class MLInput(BaseModel):
     deviceId: str = "unknown"
     timestamp: int = 0
 
+class MLBatchInput(BaseModel):
+    samples: List[List[float]]
+
 class MLOutput(BaseModel):
     freshness_prediction: float
     shelf_life_hours: float
@@ -97,6 +335,7 @@ async def root():
         "status": "running",
         "models_loaded": {
             "classifier": classifier_model is not None,
+            "onnx_classifier": classifier_session is not None,
             "scaler": feature_scaler is not None,
             "label_encoder": label_encoder is not None
         },
@@ -116,86 +355,123 @@ async def health_check():
         "accuracy": model_metadata.get('accuracy', 'N/A') if model_metadata else 'N/A'
     }
 
+def prediction_cache_key(features):
+    """Quantize a feature row into a hashable cache key"""
+    return np.round(np.asarray(features, dtype=np.float32), 3).tobytes()
+
+async def queue_prediction(features):
+    """Hand one full-length feature row to the batch worker and wait for its result"""
+    global cache_hits, cache_misses
+    
+    key = prediction_cache_key(features)
+    cached = prediction_cache.get(key)
+    if cached is not None:
+        prediction_cache.move_to_end(key)
+        cache_hits += 1
+        return cached
+    cache_misses += 1
+    
+    future = asyncio.get_running_loop().create_future()
+    await prediction_queue.put((features, future))
+    output = await future
+    
+    prediction_cache[key] = output
+    if len(prediction_cache) > PREDICTION_CACHE_SIZE:
+        prediction_cache.popitem(last=False)
+    
+    return output
+
 @app.post("/predict", response_model=MLOutput)
 async def predict(input_data: MLInput):
-    """Make predictions using the trained model"""
+    """Make predictions using the trained model (exactly n_features values required)"""
+    try:
+        if not all([classifier_model, feature_scaler, label_encoder]):
+            raise HTTPException(status_code=503, detail="Models not loaded properly")
+        
+        # Fixed-size contract: malformed requests are rejected instead of padded
+        if len(input_data.features) != n_features:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Expected {n_features} features, got {len(input_data.features)}"
+            )
+        
+        return await queue_prediction(input_data.features)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Prediction error: {e}")
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+@app.post("/predict_v1", response_model=MLOutput)
+async def predict_v1(input_data: MLInput):
+    """Legacy prediction endpoint that pads or truncates features to the model size"""
     try:
         if not all([classifier_model, feature_scaler, label_encoder]):
             raise HTTPException(status_code=503, detail="Models not loaded properly")
         
         # Validate input features
-        expected_features = len(feature_names_list) if feature_names_list else 47
-        if len(input_data.features) != expected_features:
+        if len(input_data.features) != n_features:
             # If we have fewer features, pad with zeros
-            if len(input_data.features) < expected_features:
-                padded_features = input_data.features + [0.0] * (expected_features - len(input_data.features))
-                logger.warning(f"Padded features from {len(input_data.features)} to {expected_features}")
+            if len(input_data.features) < n_features:
+                padded_features = input_data.features + [0.0] * (n_features - len(input_data.features))
+                logger.warning(f"Padded features from {len(input_data.features)} to {n_features}")
             else:
                 # If we have more features, truncate
-                padded_features = input_data.features[:expected_features]
-                logger.warning(f"Truncated features from {len(input_data.features)} to {expected_features}")
+                padded_features = input_data.features[:n_features]
+                logger.warning(f"Truncated features from {len(input_data.features)} to {n_features}")
         else:
             padded_features = input_data.features
         
-        # Prepare features
-        features = np.array(padded_features).reshape(1, -1)
-        
-        # Handle NaN and inf values
-        features = np.nan_to_num(features, nan=0.0, posinf=1e6, neginf=-1e6)
+        return await queue_prediction(padded_features)
         
-        # Scale features
-        features_scaled = feature_scaler.transform(features)
-        
-        # Make prediction with fixed random state for consistency
-        np.random.seed(42)  # Ensure consistent results
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Prediction error: {e}")
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+@app.post("/predict_batch", response_model=List[MLOutput])
+async def predict_batch(input_data: MLBatchInput):
+    """Make predictions for many samples with a single model call"""
+    try:
+        if not all([classifier_model, feature_scaler, label_encoder]):
+            raise HTTPException(status_code=503, detail="Models not loaded properly")
         
-        prediction = classifier_model.predict(features_scaled)[0]
-        probabilities = classifier_model.predict_proba(features_scaled)[0]
+        if not input_data.samples:
+            return []
         
-        # Get prediction label
-        prediction_label = label_encoder.inverse_transform([prediction])[0]
+        # Pad short rows with zeros and truncate long ones
+        features = np.zeros((len(input_data.samples), n_features), dtype=np.float32)
+        mismatched = 0
+        for i, row in enumerate(input_data.samples):
+            if len(row) != n_features:
+                mismatched += 1
+                row = row[:n_features]
+            features[i, :len(row)] = row
         
-        # Calculate freshness score and shelf life based on model output
-        fresh_class_idx = list(label_encoder.classes_).index('fresh') if 'fresh' in label_encoder.classes_ else 1
-        spoiled_class_idx = list(label_encoder.classes_).index('Spoiled') if 'Spoiled' in label_encoder.classes_ else 0
+        if mismatched:
+            logger.warning(f"Padded/truncated {mismatched} of {len(input_data.samples)} samples to {n_features} features")
         
-        if prediction == fresh_class_idx:
-            # Fresh milk
-            freshness_score = 0.7 + (probabilities[fresh_class_idx] * 0.3)  # 0.7-1.0 for fresh
-            shelf_life_hours = 48 + (probabilities[fresh_class_idx] * 24)   # 48-72 hours
-            prediction_label = 'fresh'
-        else:
-            # Spoiled milk
-            freshness_score = probabilities[spoiled_class_idx] * 0.3  # 0.0-0.3 for spoiled
-            shelf_life_hours = probabilities[spoiled_class_idx] * 12  # 0-12 hours
-            prediction_label = 'spoiled'
-        
-        # Get confidence (highest probability)
-        confidence = float(max(probabilities))
-        
-        # Get model accuracy
-        accuracy = model_metadata.get('accuracy', 0.95) if model_metadata else 0.95
-        
-        # Simple feature importance (based on feature values)
-        feature_importance = {}
-        if feature_names_list and len(feature_names_list) == len(padded_features):
-            # Normalize feature values for importance
-            normalized_features = np.abs(padded_features) / (np.max(np.abs(padded_features)) + 1e-6)
-            for i, name in enumerate(feature_names_list[:10]):  # Top 10 features
-                feature_importance[name] = float(normalized_features[i])
-        
-        return MLOutput(
-            freshness_prediction=freshness_score,
-            shelf_life_hours=shelf_life_hours,
-            confidence=confidence,
-            model_accuracy=accuracy,
-            prediction_label=prediction_label.lower(),
-            feature_importance=feature_importance
-        )
+        return score_features(features)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Prediction error: {e}")
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+        logger.error(f"Batch prediction error: {e}")
+        raise HTTPException(status_code=500, detail=f"Batch prediction failed: {str(e)}")
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    """Get hit/miss statistics of the prediction result cache"""
+    lookups = cache_hits + cache_misses
+    return {
+        "hits": cache_hits,
+        "misses": cache_misses,
+        "maxsize": PREDICTION_CACHE_SIZE,
+        "currsize": len(prediction_cache),
+        "hit_rate": cache_hits / lookups if lookups else 0.0
+    }
 
 @app.get("/model-info")
 async def get_model_info():
@@ -213,5 +489,16 @@ async def get_model_info():
     }
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8002)
\ No newline at end of file
+    
+    # Multiple workers need the app as an import string; each worker loads the
+    # models in its own lifespan. uvloop is not available on Windows.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8002,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", max(1, (os.cpu_count() or 2) // 2)))
+    )
\ No newline at end of file
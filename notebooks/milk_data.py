@@ -0,0 +1,55 @@
+"""
+Shared loading helpers for the LACTEVA fresh/spoiled milk CSV datasets
+Used by real_data_ml_training.py and simple_real_data_training.py
+"""
+
+import hashlib
+import inspect
+import pandas as pd
+from pandas.api.types import union_categoricals
+import numpy as np
+
+# Known schema of the fresh/spoiled milk CSVs, so read_csv skips type inference
+CSV_DTYPES = {
+    'timestamp_ms': 'int64',
+    'VOC_raw': 'float32',
+    'VOC_voltage': 'float32',
+    **{f'raw_ch{i}': 'float32' for i in range(12)},
+    **{f'reflect_ch{i}': 'float32' for i in range(12)},
+    **{f'absorb_ch{i}': 'float32' for i in range(12)},
+    'CFU_value': 'float32',
+    'label': 'category',
+}
+
+def read_milk_csv(path):
+    """Read one milk dataset CSV with the known column types (columns the file lacks are skipped)"""
+    return pd.read_csv(path, dtype=CSV_DTYPES, usecols=lambda col: col in CSV_DTYPES,
+                       engine='c', na_values=[''])
+
+def concat_milk_frames(fresh_df, spoiled_df):
+    """Stack the fresh and spoiled datasets, writing the float32 columns into one allocation"""
+    # Columns only one file has are NaN for the other, as with pd.concat
+    value_cols = [col for col, dtype in CSV_DTYPES.items()
+                  if dtype == 'float32' and (col in fresh_df or col in spoiled_df)]
+    n_fresh = len(fresh_df)
+
+    values = np.empty((n_fresh + len(spoiled_df), len(value_cols)), dtype=np.float32)
+    values[:n_fresh] = fresh_df.reindex(columns=value_cols).to_numpy(dtype=np.float32)
+    values[n_fresh:] = spoiled_df.reindex(columns=value_cols).to_numpy(dtype=np.float32)
+
+    df = pd.DataFrame(values, columns=value_cols, copy=False)
+    if 'timestamp_ms' in fresh_df and 'timestamp_ms' in spoiled_df:
+        df.insert(0, 'timestamp_ms', np.concatenate([fresh_df['timestamp_ms'].to_numpy(), spoiled_df['timestamp_ms'].to_numpy()]))
+    # One shared, sorted category set so the codes match a fitted LabelEncoder
+    df['label'] = union_categoricals([fresh_df['label'], spoiled_df['label']], sort_categories=True)
+    return df
+
+def source_digest(*funcs):
+    """Short hash of the given functions' source code, used to key feature caches
+
+    Numba dispatchers are hashed through their original Python function.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for func in funcs:
+        digest.update(inspect.getsource(getattr(func, 'py_func', func)).encode())
+    return digest.hexdigest()
@@ -7,19 +7,32 @@ Uses actual fresh and spoiled milk datasets for training
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import seaborn as sns
-from sklearn.model_selection import train_test_split, cross_val_score, GridSearchCV
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import train_test_split, cross_validate, StratifiedKFold, HalvingRandomSearchCV
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
-from sklearn.svm import SVC
+from sklearn.kernel_approximation import RBFSampler
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, roc_auc_score, roc_curve
 import xgboost as xgb
 import lightgbm as lgb
 import joblib
+from milk_data import read_milk_csv, concat_milk_frames, source_digest
+from joblib import Parallel, delayed
 import warnings
 import os
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+# Numba JIT for the feature-engineering kernel (optional - falls back to plain Python loops)
+try:
+    from numba import njit, prange
+except ImportError:
+    prange = range
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 warnings.filterwarnings('ignore')
 
@@ -29,29 +42,169 @@ np.random.seed(42)
 print("LACTEVA Real Data ML Training")
 print("=" * 50)
 
+FRESH_CSV = '../sample-data/Fresh_milk_dataset.csv'
+SPOILED_CSV = '../sample-data/Spoiled_Milk_dataset.csv'
+
+# Engineered feature matrices are cached here between runs
+memory = joblib.Memory('../.cache/lacteva', verbose=0)
+
+# Engineered spectral features, in the column order spectral_features writes them
+# (it only fills the first len(SPECTRAL_FEATURES) columns of its output)
+SPECTRAL_FEATURES = ['peak_intensity', 'peak_channel', 'total_intensity', 'intensity_std',
+                     'avg_reflectance', 'reflectance_range', 'avg_absorbance', 'absorbance_slope',
+                     'voc_ratio', 'ndvi_like']
+# Every column engineer_features adds: the spectral block plus log-scaled CFU
+ENGINEERED_FEATURES = SPECTRAL_FEATURES + ['log_cfu']
+
+@njit(parallel=True, fastmath=True, cache=True)
+def spectral_features(raw, reflect, absorb, voc_raw, voc_voltage, out):
+    """Compute every per-row spectral feature in one parallel pass over the channel blocks"""
+    n_raw = raw.shape[1]
+    n_reflect = reflect.shape[1]
+    n_absorb = absorb.shape[1]
+    
+    for i in prange(raw.shape[0]):
+        # Raw channels: peak, total and sample std (ddof=1) from one scan
+        peak = raw[i, 0]
+        peak_ch = 0
+        total = 0.0
+        sq_total = 0.0
+        for j in range(n_raw):
+            v = raw[i, j]
+            if v > peak:
+                peak = v
+                peak_ch = j
+            total += v
+            sq_total += v * v
+        out[i, 0] = peak
+        out[i, 1] = peak_ch
+        out[i, 2] = total
+        out[i, 3] = np.sqrt(max(sq_total - total * total / n_raw, 0.0) / (n_raw - 1))
+        
+        # Reflectance mean and range
+        lo = reflect[i, 0]
+        hi = reflect[i, 0]
+        total = 0.0
+        for j in range(n_reflect):
+            v = reflect[i, j]
+            lo = min(lo, v)
+            hi = max(hi, v)
+            total += v
+        out[i, 4] = total / n_reflect
+        out[i, 5] = hi - lo
+        
+        # Absorbance mean; the mean of consecutive differences telescopes to (last - first) / (n - 1)
+        total = 0.0
+        for j in range(n_absorb):
+            total += absorb[i, j]
+        out[i, 6] = total / n_absorb
+        out[i, 7] = (absorb[i, n_absorb - 1] - absorb[i, 0]) / (n_absorb - 1)
+        
+        # VOC ratio and the NDVI-like raw_ch8 / raw_ch4 index
+        out[i, 8] = voc_voltage[i] / (voc_raw[i] + 1e-6)
+        out[i, 9] = (raw[i, 8] - raw[i, 4]) / (raw[i, 8] + raw[i, 4] + 1e-6)
+
+def standardize_inplace(X_train, *others):
+    """Standardize float32 matrices in place with train statistics; returns the fitted StandardScaler
+
+    Statistics accumulate in float64, the arrays are scaled with one subtract and
+    one multiply each, and the returned scaler carries the same mean_/scale_ so the
+    saved artifact works unchanged in the ML service.
+    """
+    mean = X_train.mean(axis=0, dtype=np.float64)
+    var = X_train.var(axis=0, dtype=np.float64)
+    scale = np.sqrt(var)
+    scale[scale == 0] = 1.0
+    
+    mean32 = mean.astype(np.float32)
+    inv_scale32 = (1.0 / scale).astype(np.float32)
+    for X in (X_train, *others):
+        np.subtract(X, mean32, out=X)
+        np.multiply(X, inv_scale32, out=X)
+    
+    scaler = StandardScaler(copy=False)
+    scaler.mean_, scaler.var_, scaler.scale_ = mean, var, scale
+    scaler.n_features_in_ = X_train.shape[1]
+    scaler.n_samples_seen_ = X_train.shape[0]
+    return scaler
+
+def fit_and_score(name, model, X_train, X_test, y_train, y_test, cv_splits):
+    """Fit one candidate model and collect its test and cross-validation metrics"""
+    # Train model
+    model.fit(X_train, y_train)
+    
+    if isinstance(model, HalvingRandomSearchCV):
+        # The search already cross-validated its winner on the shared folds
+        search = model
+        model = search.best_estimator_
+        cv_mean = search.best_score_
+        cv_std = search.cv_results_['std_test_score'][search.best_index_]
+    else:
+        # Cross-validation score (on the shared folds; already running inside a worker, so n_jobs=1)
+        cv_scores = cross_validate(model, X_train, y_train, cv=cv_splits, scoring='accuracy', n_jobs=1)['test_score']
+        cv_mean, cv_std = cv_scores.mean(), cv_scores.std()
+    
+    # Make predictions
+    y_pred = model.predict(X_test)
+    y_pred_proba = model.predict_proba(X_test)[:, 1] if hasattr(model, 'predict_proba') else None
+    
+    return name, {
+        'model': model,
+        'accuracy': accuracy_score(y_test, y_pred),
+        'cv_mean': cv_mean,
+        'cv_std': cv_std,
+        'predictions': y_pred,
+        'probabilities': y_pred_proba
+    }
+
+def save_feature_importance_plot(feature_importance):
+    """Render the top-15 feature importance bar chart (thread-safe: no pyplot state)"""
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    sns.barplot(data=feature_importance.head(15), x='importance', y='feature', ax=ax)
+    ax.set_title('Feature Importance - Top 15 Features')
+    fig.tight_layout()
+    fig.savefig('../ml-service/models/feature_importance.png', dpi=300, bbox_inches='tight')
+
+def save_roc_plot(fpr, tpr, auc_score):
+    """Render the ROC curve (thread-safe: no pyplot state)"""
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    ax.plot(fpr, tpr, color='darkorange', lw=2, label=f'ROC curve (AUC = {auc_score:.2f})')
+    ax.plot([0, 1], [0, 1], color='navy', lw=2, linestyle='--')
+    ax.set_xlim([0.0, 1.0])
+    ax.set_ylim([0.0, 1.05])
+    ax.set_xlabel('False Positive Rate')
+    ax.set_ylabel('True Positive Rate')
+    ax.set_title('Receiver Operating Characteristic (ROC) Curve')
+    ax.legend(loc="lower right")
+    fig.savefig('../ml-service/models/roc_curve.png', dpi=300, bbox_inches='tight')
+
 class LactevaMLTrainer:
     def __init__(self):
         self.models = {}
-        self.scaler = StandardScaler()
+        self.scaler = StandardScaler(copy=False)
         self.label_encoder = LabelEncoder()
         self.feature_names = []
         self.best_model = None
         self.best_accuracy = 0
         self.training_history = {}
+        self.plot_executor = ThreadPoolExecutor(max_workers=2)
+        self.plot_futures = []
         
-    def load_datasets(self):
+    def load_datasets(self, fresh_path=FRESH_CSV, spoiled_path=SPOILED_CSV):
         """Load fresh and spoiled milk datasets"""
         print("Loading datasets...")
         
         try:
             # Load fresh milk data
-            fresh_df = pd.read_csv('../sample-data/Fresh_milk_dataset.csv')
+            fresh_df = read_milk_csv(fresh_path)
             print(f"Fresh milk samples: {len(fresh_df)}")
             print(f"Fresh milk columns: {list(fresh_df.columns)}")
             print(f"Fresh milk labels: {fresh_df['label'].value_counts()}")
             
             # Load spoiled milk data  
-            spoiled_df = pd.read_csv('../sample-data/Spoiled_Milk_dataset.csv')
+            spoiled_df = read_milk_csv(spoiled_path)
             print(f"Spoiled milk samples: {len(spoiled_df)}")
             print(f"Spoiled milk labels: {spoiled_df['label'].value_counts()}")
             
@@ -60,7 +213,7 @@ class LactevaMLTrainer:
             print(f"Spoiled data shape: {spoiled_df.shape}")
             
             # Combine datasets
-            df = pd.concat([fresh_df, spoiled_df], ignore_index=True)
+            df = concat_milk_frames(fresh_df, spoiled_df)
             print(f"Total samples: {len(df)}")
             print(f"Combined label distribution: {df['label'].value_counts()}")
             
@@ -95,19 +248,16 @@ class LactevaMLTrainer:
             print(f"  {col}: {nan_pct:.1f}% NaN")
         
         # More lenient cleaning - only remove rows that are completely empty
-        # First, fill NaN values with appropriate defaults
-        for col in feature_cols:
-            if df[col].dtype in ['float64', 'int64']:
-                # For spectral data, use 0 as default instead of median (many channels legitimately read 0)
-                if col.startswith(('raw_ch', 'reflect_ch', 'absorb_ch')):
-                    df[col] = df[col].fillna(0)
-                else:
-                    # For other numeric columns, use median
-                    median_val = df[col].median()
-                    if pd.isna(median_val):
-                        df[col] = df[col].fillna(0)
-                    else:
-                        df[col] = df[col].fillna(median_val)
+        # First, fill NaN values with appropriate defaults (one bulk call per column group)
+        numeric_cols = [col for col in feature_cols if df[col].dtype.kind in 'fi']
+        # For spectral data, use 0 as default instead of median (many channels legitimately read 0)
+        spectral_cols = [col for col in numeric_cols if col.startswith(('raw_ch', 'reflect_ch', 'absorb_ch'))]
+        # For other numeric columns, use median (0 when a column is entirely NaN)
+        other_cols = [col for col in numeric_cols if col not in spectral_cols]
+        
+        # Spectral channels are low-bit ADC readings, float32 holds them exactly
+        df[spectral_cols] = df[spectral_cols].fillna(0.0).astype(np.float32)
+        df[other_cols] = df[other_cols].fillna(df[other_cols].median(numeric_only=True)).fillna(0.0)
         
         # Only remove rows where ALL feature columns are NaN (completely empty rows)
         df = df.dropna(subset=feature_cols, how='all')
@@ -135,75 +285,38 @@ class LactevaMLTrainer:
         """Create additional engineered features"""
         print("Engineering features...")
         
-        # Calculate spectral ratios and indices
+        # Calculate spectral ratios and indices (channels a file lacks read as 0)
         raw_channels = [f'raw_ch{i}' for i in range(12)]
         reflect_channels = [f'reflect_ch{i}' for i in range(12)]
         absorb_channels = [f'absorb_ch{i}' for i in range(12)]
         
-        # Check which channels exist in the data
-        available_raw = [col for col in raw_channels if col in df.columns]
-        available_reflect = [col for col in reflect_channels if col in df.columns]
-        available_absorb = [col for col in absorb_channels if col in df.columns]
+        # Handle case where all values might be 0 or NaN
+        raw_arr = df.reindex(columns=raw_channels).fillna(0).to_numpy(dtype=np.float64)
+        reflect_arr = df.reindex(columns=reflect_channels).fillna(0).to_numpy(dtype=np.float64)
+        absorb_arr = df.reindex(columns=absorb_channels).fillna(0).to_numpy(dtype=np.float64)
+        voc = df.reindex(columns=['VOC_raw', 'VOC_voltage']).to_numpy(dtype=np.float64)
         
-        print(f"Available raw channels: {len(available_raw)}")
-        print(f"Available reflect channels: {len(available_reflect)}")
-        print(f"Available absorb channels: {len(available_absorb)}")
+        # All engineered columns go into one preallocated block (the kernel fills the spectral ones)
+        engineered = np.empty((len(df), len(ENGINEERED_FEATURES)), dtype=np.float32)
+        spectral_features(raw_arr, reflect_arr, absorb_arr,
+                          np.ascontiguousarray(voc[:, 0]), np.ascontiguousarray(voc[:, 1]),
+                          engineered)
         
-        # Peak wavelength and intensity (only if we have raw channels)
-        if len(available_raw) > 0:
-            # Handle case where all values might be 0 or NaN
-            raw_data = df[available_raw].fillna(0)
-            
-            # Only calculate if we have non-zero values
-            if (raw_data.sum(axis=1) > 0).any():
-                df['peak_intensity'] = raw_data.max(axis=1)
-                # Safer peak channel calculation
-                try:
-                    peak_indices = raw_data.idxmax(axis=1)
-                    df['peak_channel'] = peak_indices.str.extract('(\d+)').astype(float).fillna(0)
-                except:
-                    df['peak_channel'] = 0
-                df['total_intensity'] = raw_data.sum(axis=1)
-                df['intensity_std'] = raw_data.std(axis=1).fillna(0)
-            else:
-                df['peak_intensity'] = 0
-                df['peak_channel'] = 0
-                df['total_intensity'] = 0
-                df['intensity_std'] = 0
-        
-        # Reflectance features
-        if len(available_reflect) > 0:
-            reflect_data = df[available_reflect].fillna(0)
-            df['avg_reflectance'] = reflect_data.mean(axis=1)
-            df['reflectance_range'] = reflect_data.max(axis=1) - reflect_data.min(axis=1)
-        
-        # Absorbance features
-        if len(available_absorb) > 0:
-            absorb_data = df[available_absorb].fillna(0)
-            df['avg_absorbance'] = absorb_data.mean(axis=1)
-            df['absorbance_slope'] = absorb_data.diff(axis=1).mean(axis=1).fillna(0)
-        
-        # VOC features
-        if 'VOC_raw' in df.columns and 'VOC_voltage' in df.columns:
-            df['voc_ratio'] = df['VOC_voltage'] / (df['VOC_raw'] + 1e-6)
-        
-        # Spectral indices (if channels exist)
-        if 'raw_ch4' in df.columns and 'raw_ch8' in df.columns:
-            df['ndvi_like'] = (df['raw_ch8'] - df['raw_ch4']) / (df['raw_ch8'] + df['raw_ch4'] + 1e-6)
+        # Peak/intensity features are only meaningful if some raw channel reads non-zero
+        if not (engineered[:, 2] > 0).any():
+            engineered[:, :4] = 0
         
         # CFU feature engineering
-        if 'CFU_value' in df.columns:
-            df['log_cfu'] = np.log10(df['CFU_value'] + 1)
+        engineered[:, -1] = np.log10(df.reindex(columns=['CFU_value'])['CFU_value'].to_numpy(dtype=np.float64) + 1)
         
-        # Update feature names - only include features that were actually created
-        new_features = ['peak_intensity', 'peak_channel', 'total_intensity', 'intensity_std',
-                       'avg_reflectance', 'reflectance_range', 'avg_absorbance', 'absorbance_slope',
-                       'voc_ratio', 'ndvi_like', 'log_cfu']
+        # One concat instead of a BlockManager insert per engineered column
+        engineered_df = pd.DataFrame(engineered, columns=ENGINEERED_FEATURES, index=df.index, copy=False)
+        df = pd.concat([df, engineered_df], axis=1, copy=False)
         
-        available_new_features = [f for f in new_features if f in df.columns]
-        self.feature_names = feature_cols + available_new_features
+        # Update feature names
+        self.feature_names = feature_cols + ENGINEERED_FEATURES
         
-        print(f"Engineered features added: {available_new_features}")
+        print(f"Engineered features added: {ENGINEERED_FEATURES}")
         print(f"Total features after engineering: {len(self.feature_names)}")
         
         return df
@@ -212,61 +325,91 @@ class LactevaMLTrainer:
         """Train multiple ML models and select the best one"""
         print("\nTraining ML models...")
         
-        # Define models to train
-        models = {
-            'Random Forest': RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1),
-            'XGBoost': xgb.XGBClassifier(random_state=42, eval_metric='logloss'),
-            'LightGBM': lgb.LGBMClassifier(random_state=42, verbose=-1),
-            'Gradient Boosting': GradientBoostingClassifier(random_state=42),
-            'SVM': SVC(random_state=42, probability=True)
+        # One set of stratified folds shared by every model, so CV scores are comparable
+        skf = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
+        cv_splits = list(skf.split(X_train, y_train))
+        
+        # Tree ensembles are tuned with successive halving: random candidates are
+        # scored on a slice of the samples and only the best get the full training set
+        def halving_search(estimator, param_distributions):
+            return HalvingRandomSearchCV(
+                estimator, param_distributions, resource='n_samples', factor=3,
+                cv=skf, scoring='accuracy', n_jobs=1, random_state=42
+            )
+        
+        # Define models to train (tree ensembles ignore feature scaling, so they get raw features)
+        tree_models = {
+            'Random Forest': halving_search(
+                RandomForestClassifier(random_state=42, n_jobs=1),
+                {'n_estimators': [100, 200, 400], 'max_depth': [None, 10, 20], 'min_samples_leaf': [1, 5, 10]}
+            ),
+            'XGBoost': halving_search(
+                xgb.XGBClassifier(random_state=42, eval_metric='logloss'),
+                {'n_estimators': [100, 200, 400], 'max_depth': [3, 6, 10], 'learning_rate': [0.05, 0.1, 0.3]}
+            ),
+            'LightGBM': halving_search(
+                lgb.LGBMClassifier(random_state=42, verbose=-1),
+                {'n_estimators': [100, 200, 400], 'num_leaves': [15, 31, 63], 'min_child_samples': [5, 20, 50]}
+            ),
+            'Gradient Boosting': GradientBoostingClassifier(random_state=42)
+        }
+        scaled_models = {
+            # RBF kernel approximated with random Fourier features: linear in samples and
+            # calibrated probabilities without SVC's internal Platt-scaling CV
+            'SVM_RFF': make_pipeline(
+                RBFSampler(gamma=1.0 / X_train.shape[1], n_components=500, random_state=42),
+                LogisticRegression(max_iter=2000, random_state=42)
+            )
         }
         
-        results = {}
+        jobs = [(name, model, X_train, X_test) for name, model in tree_models.items()]
         
-        for name, model in models.items():
-            print(f"\nTraining {name}...")
-            
-            # Train model
-            model.fit(X_train, y_train)
-            
-            # Make predictions
-            y_pred = model.predict(X_test)
-            y_pred_proba = model.predict_proba(X_test)[:, 1] if hasattr(model, 'predict_proba') else None
-            
-            # Calculate metrics
-            accuracy = accuracy_score(y_test, y_pred)
-            
-            # Cross-validation score
-            cv_scores = cross_val_score(model, X_train, y_train, cv=5, scoring='accuracy')
-            
-            results[name] = {
-                'model': model,
-                'accuracy': accuracy,
-                'cv_mean': cv_scores.mean(),
-                'cv_std': cv_scores.std(),
-                'predictions': y_pred,
-                'probabilities': y_pred_proba
-            }
+        # Only the distance-based models need standardized features (scaled copies,
+        # the tree models keep training on the raw arrays)
+        if scaled_models:
+            X_train_scaled = X_train.copy()
+            X_test_scaled = X_test.copy()
+            self.scaler = standardize_inplace(X_train_scaled, X_test_scaled)
+            jobs += [(name, model, X_train_scaled, X_test_scaled) for name, model in scaled_models.items()]
+        
+        # Each estimator is fitted and cross-validated in its own worker process
+        results_list = Parallel(n_jobs=min(len(jobs), os.cpu_count() or 1), backend='loky')(
+            delayed(fit_and_score)(name, model, X_tr, X_te, y_train, y_test, cv_splits)
+            for name, model, X_tr, X_te in jobs
+        )
+        
+        results = {}
+        for name, result in results_list:
+            results[name] = result
             
-            print(f"  Accuracy: {accuracy:.4f}")
-            print(f"  CV Score: {cv_scores.mean():.4f} (+/- {cv_scores.std() * 2:.4f})")
+            print(f"\n{name}:")
+            print(f"  Accuracy: {result['accuracy']:.4f}")
+            print(f"  CV Score: {result['cv_mean']:.4f} (+/- {result['cv_std'] * 2:.4f})")
             
             # Update best model
-            if accuracy > self.best_accuracy:
-                self.best_accuracy = accuracy
-                self.best_model = model
+            if result['accuracy'] > self.best_accuracy:
+                self.best_accuracy = result['accuracy']
+                self.best_model = result['model']
                 self.best_model_name = name
         
+        if self.best_model_name not in scaled_models:
+            # Tree models were trained unscaled, so save an identity scaler. A no-op
+            # StandardScaler rather than FunctionTransformer: the ML service reads
+            # mean_/scale_ from scaler.joblib and treats None as no scaling
+            self.scaler = StandardScaler(with_mean=False, with_std=False).fit(X_train)
+        
         self.models = results
         return results
     
-    def evaluate_best_model(self, X_test, y_test):
+    def evaluate_best_model(self, y_test):
         """Detailed evaluation of the best model"""
         print(f"\nDetailed evaluation of best model: {self.best_model_name}")
         print("-" * 50)
         
-        y_pred = self.best_model.predict(X_test)
-        y_pred_proba = self.best_model.predict_proba(X_test)[:, 1]
+        # Reuse the test-set predictions train_models already made for this model
+        cached = self.models[self.best_model_name]
+        y_pred = cached['predictions']
+        y_pred_proba = cached['probabilities']
         
         # Classification report
         print("Classification Report:")
@@ -295,27 +438,16 @@ class LactevaMLTrainer:
             print(f"\nTop 10 Most Important Features:")
             print(feature_importance.head(10))
             
-            # Save feature importance plot
-            plt.figure(figsize=(10, 8))
-            sns.barplot(data=feature_importance.head(15), x='importance', y='feature')
-            plt.title('Feature Importance - Top 15 Features')
-            plt.tight_layout()
-            plt.savefig('../ml-service/models/feature_importance.png', dpi=300, bbox_inches='tight')
-            plt.close()
+        # Plots are rendered on background threads and overlap with save_models
+        os.makedirs('../ml-service/models', exist_ok=True)
+        
+        # Save feature importance plot
+        if hasattr(self.best_model, 'feature_importances_'):
+            self.plot_futures.append(self.plot_executor.submit(save_feature_importance_plot, feature_importance))
         
         # ROC Curve
         fpr, tpr, _ = roc_curve(y_test, y_pred_proba)
-        plt.figure(figsize=(8, 6))
-        plt.plot(fpr, tpr, color='darkorange', lw=2, label=f'ROC curve (AUC = {auc_score:.2f})')
-        plt.plot([0, 1], [0, 1], color='navy', lw=2, linestyle='--')
-        plt.xlim([0.0, 1.0])
-        plt.ylim([0.0, 1.05])
-        plt.xlabel('False Positive Rate')
-        plt.ylabel('True Positive Rate')
-        plt.title('Receiver Operating Characteristic (ROC) Curve')
-        plt.legend(loc="lower right")
-        plt.savefig('../ml-service/models/roc_curve.png', dpi=300, bbox_inches='tight')
-        plt.close()
+        self.plot_futures.append(self.plot_executor.submit(save_roc_plot, fpr, tpr, auc_score))
         
         return {
             'accuracy': accuracy,
@@ -331,6 +463,15 @@ class LactevaMLTrainer:
         # Create models directory
         os.makedirs('../ml-service/models', exist_ok=True)
         
+        # Remove exports left over from earlier runs (including improved_ml_training.py's
+        # pipeline): the service prefers them over the joblib classifier saved below, so
+        # an ONNX file is only present if this run writes it
+        for stale_path in ['../ml-service/models/pipeline.joblib', '../ml-service/models/lacteva_pipeline.onnx',
+                           '../ml-service/models/lacteva_classifier.onnx']:
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+                print(f"✓ Removed stale {stale_path}")
+        
         # Save best model
         joblib.dump(self.best_model, '../ml-service/models/lacteva_classifier.joblib')
         
@@ -360,76 +501,81 @@ class LactevaMLTrainer:
         print("✓ Saved feature names")
         print("✓ Saved model metadata")
         
-        # Try to convert to ONNX (optional)
+        # Try to convert to ONNX (optional). Written to a temp file and moved into
+        # place only on success, so a failed export never leaves a partial graph
+        onnx_path = '../ml-service/models/lacteva_classifier.onnx'
+        tmp_path = onnx_path + '.tmp'
         try:
             from skl2onnx import convert_sklearn
             from skl2onnx.common.data_types import FloatTensorType
             
             initial_type = [('float_input', FloatTensorType([None, len(self.feature_names)]))]
-            onnx_model = convert_sklearn(self.best_model, initial_types=initial_type)
+            # ZipMap off: probabilities come back as a plain tensor, as the ML service expects
+            onnx_model = convert_sklearn(self.best_model, initial_types=initial_type, target_opset=17,
+                                         options={id(self.best_model): {'zipmap': False}})
             
-            with open('../ml-service/models/lacteva_classifier.onnx', 'wb') as f:
+            with open(tmp_path, 'wb') as f:
                 f.write(onnx_model.SerializeToString())
+            os.replace(tmp_path, onnx_path)
             
             print("✓ Saved ONNX model")
             
         except ImportError:
-            print("⚠ ONNX conversion skipped (skl2onnx not available)")
+            print("⚠ ONNX conversion skipped (skl2onnx not available) - the ML service will use the joblib classifier")
         except Exception as e:
-            print(f"⚠ ONNX conversion failed: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            print(f"⚠ ONNX conversion failed: {e} - the ML service will use the joblib classifier")
     
     def run_training_pipeline(self):
         """Run the complete training pipeline"""
         print("Starting LACTEVA ML Training Pipeline")
         print("=" * 50)
         
-        # Load datasets
-        df = self.load_datasets()
-        if df is None:
+        # Load, preprocess and engineer features (cached until either CSV or the feature code changes)
+        try:
+            mtimes = (os.path.getmtime(FRESH_CSV), os.path.getmtime(SPOILED_CSV))
+        except FileNotFoundError as e:
+            print(f"Error loading datasets: {e}")
+            print("Please ensure Fresh_milk_dataset.csv and Spoiled_Milk_dataset.csv are in sample-data/")
             return False
         
-        # Preprocess data
-        result = self.preprocess_data(df)
-        if result[0] is None:
+        features = build_feature_frame(FRESH_CSV, SPOILED_CSV, *mtimes, feature_code_version())
+        if features is None:
             print("❌ Preprocessing failed - no data remaining")
             return False
         
-        df, feature_cols = result
-        
-        # Engineer features
-        df = self.engineer_features(df, feature_cols)
-        
         # Prepare features and labels
-        X = df[self.feature_names].values
-        y = self.label_encoder.fit_transform(df['label'].values)
+        X, y, self.feature_names, self.label_encoder.classes_ = features
         
         print(f"\nDataset Summary:")
         print(f"Samples: {len(X)}")
         print(f"Features: {len(self.feature_names)}")
         print(f"Classes: {list(self.label_encoder.classes_)}")
-        print(f"Class distribution: {np.bincount(y)}")
+        print(f"Class distribution: {np.bincount(y, minlength=len(self.label_encoder.classes_))}")
         
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(
             X, y, test_size=0.2, random_state=42, stratify=y
         )
         
-        # Scale features
-        X_train_scaled = self.scaler.fit_transform(X_train)
-        X_test_scaled = self.scaler.transform(X_test)
-        
-        print(f"\nTraining set: {X_train_scaled.shape}")
-        print(f"Test set: {X_test_scaled.shape}")
+        print(f"\nTraining set: {X_train.shape}")
+        print(f"Test set: {X_test.shape}")
         
-        # Train models
-        results = self.train_models(X_train_scaled, X_test_scaled, y_train, y_test)
+        # Train models (features are scaled inside, only for the models that need it)
+        results = self.train_models(X_train, X_test, y_train, y_test)
         
         # Evaluate best model
-        evaluation = self.evaluate_best_model(X_test_scaled, y_test)
+        evaluation = self.evaluate_best_model(y_test)
         
         # Save models
         self.save_models()
         
+        # Wait for the evaluation plots rendered in the background
+        for future in self.plot_futures:
+            future.result()
+        print("✓ Saved evaluation plots")
+        
         print("\n" + "=" * 50)
         print("Training Complete!")
         print(f"Best Model: {self.best_model_name}")
@@ -439,6 +585,37 @@ class LactevaMLTrainer:
         
         return True
 
+def feature_code_version():
+    """Hash of the code build_feature_frame runs, so editing any of it rebuilds the cache"""
+    return source_digest(read_milk_csv, concat_milk_frames, LactevaMLTrainer.load_datasets,
+                         LactevaMLTrainer.preprocess_data, LactevaMLTrainer.engineer_features,
+                         spectral_features)
+
+@memory.cache
+def build_feature_frame(fresh_path, spoiled_path, fresh_mtime, spoiled_mtime, code_version):
+    """Load, clean and feature-engineer both CSVs into (X, y, feature_names, classes)
+
+    The modification times and code version are only there to key the cache, so
+    editing either CSV or the feature code rebuilds the features instead of hashing
+    the data itself.
+    """
+    trainer = LactevaMLTrainer()
+    
+    df = trainer.load_datasets(fresh_path, spoiled_path)
+    if df is None:
+        return None
+    
+    df, feature_cols = trainer.preprocess_data(df)
+    if df is None:
+        return None
+    
+    df = trainer.engineer_features(df, feature_cols)
+    
+    X = df[trainer.feature_names].to_numpy(dtype=np.float32)
+    # Category codes are the LabelEncoder encoding (categories are sorted)
+    y = df['label'].cat.codes.to_numpy(dtype=np.int8, copy=False)
+    return X, y, trainer.feature_names, df['label'].cat.categories.to_numpy()
+
 def main():
     """Main training function"""
     trainer = LactevaMLTrainer()
@@ -11,25 +11,32 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.metrics import classification_report, accuracy_score
 import joblib
+from milk_data import read_milk_csv, concat_milk_frames, source_digest
 import os
 import warnings
 warnings.filterwarnings('ignore')
 
 
-def load_and_prepare_data():
+FRESH_CSV = '../sample-data/Fresh_milk_dataset.csv'
+SPOILED_CSV = '../sample-data/Spoiled_Milk_dataset.csv'
+
+# Engineered feature frames are cached here between runs
+memory = joblib.Memory('../.cache/lacteva', verbose=0)
+
+def load_and_prepare_data(fresh_path=FRESH_CSV, spoiled_path=SPOILED_CSV):
     """Load and prepare the datasets"""
     print("Loading datasets...")
     
     try:
         # Load datasets
-        fresh_df = pd.read_csv('../sample-data/Fresh_milk_dataset.csv')
-        spoiled_df = pd.read_csv('../sample-data/Spoiled_Milk_dataset.csv')
+        fresh_df = read_milk_csv(fresh_path)
+        spoiled_df = read_milk_csv(spoiled_path)
         
         print(f"Fresh samples: {len(fresh_df)}")
         print(f"Spoiled samples: {len(spoiled_df)}")
         
         # Combine datasets
-        df = pd.concat([fresh_df, spoiled_df], ignore_index=True)
+        df = concat_milk_frames(fresh_df, spoiled_df)
         print(f"Total samples: {len(df)}")
         
         return df
@@ -45,13 +52,17 @@ def preprocess_data(df):
     # Get all numeric columns except timestamp and label
     feature_cols = [col for col in df.columns 
                    if col not in ['timestamp_ms', 'label'] 
-                   and df[col].dtype in ['int64', 'float64']]
+                   and df[col].dtype.kind in 'fi']
     
     print(f"Feature columns: {len(feature_cols)}")
     
     # Fill NaN values with 0 (appropriate for spectral data)
     df[feature_cols] = df[feature_cols].fillna(0)
     
+    # Spectral channels are low-bit ADC readings, float32 holds them exactly
+    spectral_cols = [col for col in feature_cols if col.startswith(('raw_ch', 'reflect_ch', 'absorb_ch'))]
+    df[spectral_cols] = df[spectral_cols].astype(np.float32)
+    
     # Replace inf values with large numbers
     df[feature_cols] = df[feature_cols].replace([np.inf, -np.inf], [1e6, -1e6])
     
@@ -77,19 +88,22 @@ def create_simple_features(df, feature_cols):
     print(f"Absorb channels: {len(absorb_channels)}")
     
     # Simple aggregated features
+    # (each channel block is read into one array and every statistic reuses it)
     if raw_channels:
-        df['raw_sum'] = df[raw_channels].sum(axis=1)
-        df['raw_mean'] = df[raw_channels].mean(axis=1)
-        df['raw_max'] = df[raw_channels].max(axis=1)
-        df['raw_std'] = df[raw_channels].std(axis=1).fillna(0)
+        raw_arr = df[raw_channels].to_numpy(dtype=np.float64)
+        n = raw_arr.shape[1]
+        raw_sum = raw_arr.sum(axis=1)
+        raw_sq_sum = np.einsum('ij,ij->i', raw_arr, raw_arr)
+        raw_std = np.sqrt(np.maximum(raw_sq_sum - raw_sum * raw_sum / n, 0) / (n - 1)) if n > 1 else 0.0
+        df = df.assign(raw_sum=raw_sum, raw_mean=raw_sum / n, raw_max=raw_arr.max(axis=1), raw_std=raw_std)
     
     if reflect_channels:
-        df['reflect_sum'] = df[reflect_channels].sum(axis=1)
-        df['reflect_mean'] = df[reflect_channels].mean(axis=1)
+        reflect_sum = df[reflect_channels].to_numpy(dtype=np.float64).sum(axis=1)
+        df = df.assign(reflect_sum=reflect_sum, reflect_mean=reflect_sum / len(reflect_channels))
     
     if absorb_channels:
-        df['absorb_sum'] = df[absorb_channels].sum(axis=1)
-        df['absorb_mean'] = df[absorb_channels].mean(axis=1)
+        absorb_sum = df[absorb_channels].to_numpy(dtype=np.float64).sum(axis=1)
+        df = df.assign(absorb_sum=absorb_sum, absorb_mean=absorb_sum / len(absorb_channels))
     
     # Add new features to feature list
     new_features = ['raw_sum', 'raw_mean', 'raw_max', 'raw_std', 
@@ -103,20 +117,38 @@ def create_simple_features(df, feature_cols):
     
     return df, all_features
 
+def feature_code_version():
+    """Hash of the code build_feature_frame runs, so editing any of it rebuilds the cache"""
+    return source_digest(read_milk_csv, concat_milk_frames, load_and_prepare_data,
+                         preprocess_data, create_simple_features)
+
+@memory.cache
+def build_feature_frame(fresh_path, spoiled_path, fresh_mtime, spoiled_mtime, code_version):
+    """Load, preprocess and feature-engineer both CSVs (mtimes and code_version only key the cache)"""
+    df = load_and_prepare_data(fresh_path, spoiled_path)
+    if df is None:
+        return None, None
+    
+    df, feature_cols = preprocess_data(df)
+    if len(df) == 0:
+        return df, feature_cols
+    
+    return create_simple_features(df, feature_cols)
+
 def train_model(df, feature_cols):
     """Train a robust and consistent model"""
     print("Training model...")
     
     # Prepare data
-    X = df[feature_cols].values
-    y = df['label'].values
+    X = df[feature_cols].to_numpy(dtype=np.float32)
     
-    # Encode labels
+    # Encode labels (category codes are the LabelEncoder encoding, categories are sorted)
     label_encoder = LabelEncoder()
-    y_encoded = label_encoder.fit_transform(y)
+    y_encoded = df['label'].cat.codes.to_numpy(dtype=np.int8, copy=False)
+    label_encoder.classes_ = df['label'].cat.categories.to_numpy()
     
     print(f"Classes: {label_encoder.classes_}")
-    print(f"Class distribution: {np.bincount(y_encoded)}")
+    print(f"Class distribution: {np.bincount(y_encoded, minlength=len(label_encoder.classes_))}")
     
     # Split data with stratification for balanced training
     X_train, X_test, y_train, y_test = train_test_split(
@@ -124,7 +156,7 @@ def train_model(df, feature_cols):
     )
     
     # Scale features for consistency
-    scaler = StandardScaler()
+    scaler = StandardScaler(copy=False)
     X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
     
@@ -170,6 +202,15 @@ def save_models(model, scaler, label_encoder, feature_names, accuracy):
     # Create models directory
     os.makedirs('../ml-service/models', exist_ok=True)
     
+    # Remove exports left over from earlier runs (including improved_ml_training.py's
+    # pipeline): the service prefers them over the joblib classifier saved below, so
+    # an ONNX file is only present if this run writes it
+    for stale_path in ['../ml-service/models/pipeline.joblib', '../ml-service/models/lacteva_pipeline.onnx',
+                       '../ml-service/models/lacteva_classifier.onnx']:
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+            print(f"✓ Removed stale {stale_path}")
+    
     # Save models
     joblib.dump(model, '../ml-service/models/lacteva_classifier.joblib')
     joblib.dump(scaler, '../ml-service/models/scaler.joblib')
@@ -197,21 +238,22 @@ def main():
     print("LACTEVA Simple Real Data Training")
     print("=" * 40)
     
-    # Load data
-    df = load_and_prepare_data()
-    if df is None:
+    # Load, preprocess and engineer features (cached until either CSV or the feature code changes)
+    try:
+        mtimes = (os.path.getmtime(FRESH_CSV), os.path.getmtime(SPOILED_CSV))
+    except OSError as e:
+        print(f"Error loading data: {e}")
         print("❌ Failed to load data")
         return False
     
-    # Preprocess
-    df, feature_cols = preprocess_data(df)
+    df, all_features = build_feature_frame(FRESH_CSV, SPOILED_CSV, *mtimes, feature_code_version())
+    if df is None:
+        print("❌ Failed to load data")
+        return False
     if len(df) == 0:
         print("❌ No data remaining after preprocessing")
         return False
     
-    # Engineer features
-    df, all_features = create_simple_features(df, feature_cols)
-    
     # Train model
     model, scaler, label_encoder, feature_names, accuracy = train_model(df, all_features)
     
@@ -4,77 +4,113 @@ Generate sample CSV data for LACTEVA device testing
 This script creates realistic spectral readings that can be used to test the dashboard
 """
 
-import csv
-import random
-import time
+import argparse
 import math
-from datetime import datetime, timedelta
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import NamedTuple
+
+# Numba JIT for the spectral channel kernel (optional - falls back to plain Python loops)
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+# AS7341 has 12 channels (415nm to 980nm approximately)
+WAVELENGTHS = np.array([415, 445, 480, 515, 555, 590, 630, 680, 910, 940, 960, 980])
+
+# Base intensity is BASE_INTENSITY + freshness * FRESH_COEF (visible vs NIR range)
+VISIBLE = WAVELENGTHS < 600
+BASE_INTENSITY = np.where(VISIBLE, 1000.0, 800.0)
+FRESH_COEF = np.where(VISIBLE, 2000.0, 1500.0)
+# Green peak for fresh milk, red increases with spoilage
+GREEN_PEAK = (WAVELENGTHS == 555) * 0.5
+RED_SPOIL = (WAVELENGTHS == 630) * 0.8
+
+# LED modes the device cycles through
+LED_MODES = np.array(["WHITE", "UV", "BLUE"], dtype='U5')
+
+# Seconds between readings in the simulated real-time stream
+REALTIME_INTERVAL_S = 30
+# Flush the real-time stream file every this many samples
+REALTIME_FLUSH_EVERY = 10
+# Nanoseconds between progress line updates
+PROGRESS_INTERVAL_NS = 1_000_000_000
+PROGRESS_TEMPLATE = "\rSamples generated: %d | Freshness: %.2f"
 
-def generate_spectral_reading(device_id="LACTEVA_001", freshness_level=0.8):
+# Root seed so repeated runs produce the same files
+SEED = 42
+
+def make_rng(seed=None):
+    """NumPy Generator backed by SFC64, faster than the default PCG64 for bulk draws"""
+    return np.random.Generator(np.random.SFC64(seed))
+
+@njit(cache=True)
+def fill_spectral_channels(freshness, noise, raw, reflect, absorb):
+    """Fill raw, reflectance and absorbance channels element by element from standard normal noise (n, 3, 12)"""
+    for i in range(raw.shape[0]):
+        f = freshness[i]
+        s = 1 - f
+        for c in range(raw.shape[1]):
+            # Base intensity varies by wavelength range and freshness
+            base = (BASE_INTENSITY[c] + f * FRESH_COEF[c]) * (1 + f * GREEN_PEAK[c] + s * RED_SPOIL[c])
+            r = max(0, int(base * (1 + 0.1 * noise[i, 0, c])))
+            raw[i, c] = r
+            
+            # Reflectance (percentage of reflected light, typically 10-90% of raw intensity)
+            refl = min(max(r / 4000 * 80 + 10 + 5 * noise[i, 1, c], 0.0), 100.0)
+            reflect[i, c] = refl
+            
+            # Absorbance = -log10(reflectance/100), high absorbance for zero reflectance
+            if refl > 0:
+                absorb[i, c] = max(2 - math.log10(refl) + 0.1 * noise[i, 2, c], 0.0)
+            else:
+                absorb[i, c] = 2.0
+
+def generate_spectral_batch(freshness, rng=None, start_ms=None):
     """
-    Generate a single spectral reading
-    freshness_level: 0.0 (spoiled) to 1.0 (fresh)
+    Generate one spectral reading per entry of freshness, all at once
+    freshness: array of levels, 0.0 (spoiled) to 1.0 (fresh)
+    Returns a dict of column arrays, channel columns have shape (n, 12)
     """
-    timestamp_ms = int(time.time() * 1000)
+    rng = rng if rng is not None else make_rng()
+    freshness = np.asarray(freshness, dtype=np.float64)
+    n = len(freshness)
+    staleness = 1 - freshness
+    
+    # Readings are spaced 10 ms apart starting now
+    if start_ms is None:
+        start_ms = int(time.time() * 1000)
+    timestamp_ms = start_ms + np.arange(n, dtype=np.int64) * 10
     
     # VOC levels (higher = more spoiled)
-    voc_base = 200 + (1 - freshness_level) * 800
-    voc_raw = voc_base + random.gauss(0, 50)
+    voc_raw = 200 + staleness * 800 + rng.normal(0, 50, n)
     voc_voltage = voc_raw * 0.003  # Convert to voltage
     
     # LED mode
-    led_mode = random.choice(["WHITE", "UV", "BLUE"])
-    
-    # AS7341 has 12 channels (415nm to 980nm approximately)
-    wavelengths = [415, 445, 480, 515, 555, 590, 630, 680, 910, 940, 960, 980]
-    
-    # Generate raw channel data
-    raw_channels = []
-    for i, wl in enumerate(wavelengths):
-        # Base intensity varies by wavelength and freshness
-        if wl < 600:  # Visible range
-            base_intensity = 1000 + freshness_level * 2000
-        else:  # NIR range
-            base_intensity = 800 + freshness_level * 1500
-        
-        # Add wavelength-specific variations
-        if wl == 555:  # Green peak for fresh milk
-            base_intensity *= (1 + freshness_level * 0.5)
-        elif wl == 630:  # Red increases with spoilage
-            base_intensity *= (1 + (1 - freshness_level) * 0.8)
-        
-        # Add noise
-        intensity = base_intensity + random.gauss(0, base_intensity * 0.1)
-        raw_channels.append(max(0, int(intensity)))
-    
-    # Generate reflectance data (percentage of reflected light)
-    reflect_channels = []
-    for raw in raw_channels:
-        # Reflectance typically 10-90% of raw intensity
-        reflectance = (raw / 4000) * 80 + 10 + random.gauss(0, 5)
-        reflect_channels.append(max(0, min(100, reflectance)))
-    
-    # Generate absorbance data (log scale)
-    abs_channels = []
-    for reflect in reflect_channels:
-        # Absorbance = -log10(reflectance/100)
-        if reflect > 0:
-            absorbance = -math.log10(reflect / 100) + random.gauss(0, 0.1)
-        else:
-            absorbance = 2.0  # High absorbance for zero reflectance
-        abs_channels.append(max(0, absorbance))
+    led_mode = LED_MODES[rng.integers(0, len(LED_MODES), n)]
+    
+    # raw -> reflectance -> absorbance for every channel in one compiled pass,
+    # the same kernel single readings go through
+    shape = (n, len(WAVELENGTHS))
+    raw_channels = np.empty(shape, dtype=np.int32)
+    reflect_channels = np.empty(shape, dtype=np.float32)
+    abs_channels = np.empty(shape, dtype=np.float32)
+    fill_spectral_channels(freshness, rng.standard_normal((n, 3, len(WAVELENGTHS)), dtype=np.float32),
+                           raw_channels, reflect_channels, abs_channels)
     
     # CFU estimate (colony forming units - bacteria count)
-    # Fresh milk: 1000-10000 CFU/mL
-    # Spoiled milk: 100000+ CFU/mL
-    cfu_base = 1000 + (1 - freshness_level) * 500000
-    cfu_estimate = int(cfu_base * random.lognormvariate(0, 0.5))
+    cfu_base = 1000 + staleness * 500000
+    cfu_estimate = (cfu_base * rng.lognormal(0, 0.5, n)).astype(np.int64)
     
     return {
         'timestamp_ms': timestamp_ms,
-        'device_id': device_id,
-        'voc_raw': voc_raw,
-        'voc_voltage': voc_voltage,
+        'voc_raw': voc_raw.astype(np.float32),
+        'voc_voltage': voc_voltage.astype(np.float32),
         'led_mode': led_mode,
         'raw_channels': raw_channels,
         'reflect_channels': reflect_channels,
@@ -82,56 +118,84 @@ def generate_spectral_reading(device_id="LACTEVA_001", freshness_level=0.8):
         'cfu_estimate': cfu_estimate
     }
 
-def format_csv_line(reading):
-    """Format reading as CSV line matching the expected format"""
-    # CSV format: timestamp_ms,VOC_raw,VOC_voltage,LED_Mode,raw_ch0..raw_ch11,reflect_ch0..reflect_ch11,abs_ch0..abs_ch11,CFU_est
-    
-    line_parts = [
-        str(reading['timestamp_ms']),
-        f"{reading['voc_raw']:.1f}",
-        f"{reading['voc_voltage']:.3f}",
-        reading['led_mode']
-    ]
-    
-    # Add raw channels
-    line_parts.extend([str(ch) for ch in reading['raw_channels']])
-    
-    # Add reflectance channels
-    line_parts.extend([f"{ch:.2f}" for ch in reading['reflect_channels']])
-    
-    # Add absorbance channels
-    line_parts.extend([f"{ch:.3f}" for ch in reading['abs_channels']])
-    
-    # Add CFU estimate
-    line_parts.append(str(reading['cfu_estimate']))
+class Reading(NamedTuple):
+    """A single spectral reading, channel fields hold 12 values each"""
+    timestamp_ms: int
+    device_id: str
+    voc_raw: float
+    voc_voltage: float
+    led_mode: str
+    raw_channels: list
+    reflect_channels: list
+    abs_channels: list
+    cfu_estimate: int
+
+def generate_spectral_reading(device_id="LACTEVA_001", freshness_level=0.8, *, rng=None, timestamp_ms=None):
+    """
+    Generate a single spectral reading for per-call producers like the real-time stream
+    freshness_level: 0.0 (spoiled) to 1.0 (fresh)
+    """
+    # A batch of one, so single readings share every formula with the batch path
+    batch = generate_spectral_batch([freshness_level], rng, start_ms=timestamp_ms)
     
-    return "CSV," + ",".join(line_parts)
+    return Reading(
+        timestamp_ms=int(batch['timestamp_ms'][0]),
+        device_id=device_id,
+        voc_raw=float(batch['voc_raw'][0]),
+        voc_voltage=float(batch['voc_voltage'][0]),
+        led_mode=str(batch['led_mode'][0]),
+        raw_channels=batch['raw_channels'][0].tolist(),
+        reflect_channels=batch['reflect_channels'][0].tolist(),
+        abs_channels=batch['abs_channels'][0].tolist(),
+        cfu_estimate=int(batch['cfu_estimate'][0])
+    )
+
+# CSV format: timestamp_ms,VOC_raw,VOC_voltage,LED_Mode,raw_ch0..raw_ch11,reflect_ch0..reflect_ch11,abs_ch0..abs_ch11,CFU_est
+CSV_ROW_FORMAT = ("CSV,%d,%.1f,%.3f,%s,"
+                  + ",".join(["%d"] * 12) + ","
+                  + ",".join(["%.2f"] * 12) + ","
+                  + ",".join(["%.3f"] * 12) + ",%d\n")
+CSV_COLUMNS = ['timestamp_ms', 'voc_raw', 'voc_voltage', 'led_mode',
+               'raw_channels', 'reflect_channels', 'abs_channels', 'cfu_estimate']
 
-def generate_sample_dataset(filename="sample_readings.csv", num_samples=100):
+SAMPLE_HEADER = ("# LACTEVA Sample Data\n"
+                 "# Format: CSV,timestamp_ms,VOC_raw,VOC_voltage,LED_Mode,raw_ch0-11,reflect_ch0-11,abs_ch0-11,CFU_est\n")
+HISTORICAL_HEADER = "# Historical data for %s\n"
+
+def format_csv_lines(batch):
+    """Format a batch of readings as newline-terminated CSV lines matching the expected format"""
+    # One precompiled format per row over native Python values
+    columns = [batch[name].tolist() for name in CSV_COLUMNS]
+    return [CSV_ROW_FORMAT % (ts, voc_raw, voc_voltage, led_mode, *raw, *reflect, *absorb, cfu)
+            for ts, voc_raw, voc_voltage, led_mode, raw, reflect, absorb, cfu in zip(*columns)]
+
+def format_csv_line(reading):
+    """Format a single Reading as a newline-terminated CSV line"""
+    return CSV_ROW_FORMAT % (reading.timestamp_ms, reading.voc_raw, reading.voc_voltage, reading.led_mode,
+                             *reading.raw_channels, *reading.reflect_channels, *reading.abs_channels,
+                             reading.cfu_estimate)
+
+def write_csv_file(filename, header, batch):
+    """Build a whole offline CSV file in memory and write it with a single call"""
+    with open(filename, 'wb') as csvfile:
+        csvfile.write((header + "".join(format_csv_lines(batch))).encode())
+
+def generate_sample_dataset(filename="sample_readings.csv", num_samples=100, seed=None):
     """Generate a complete sample dataset"""
     print(f"Generating {num_samples} sample readings...")
     
-    with open(filename, 'w', newline='') as csvfile:
-        # Write header comment
-        csvfile.write("# LACTEVA Sample Data\n")
-        csvfile.write("# Format: CSV,timestamp_ms,VOC_raw,VOC_voltage,LED_Mode,raw_ch0-11,reflect_ch0-11,abs_ch0-11,CFU_est\n")
-        
-        for i in range(num_samples):
-            # Simulate milk degradation over time
-            # Start fresh and gradually spoil
-            freshness = max(0.1, 1.0 - (i / num_samples) * 0.9)
-            
-            # Add some randomness
-            freshness += random.gauss(0, 0.1)
-            freshness = max(0.0, min(1.0, freshness))
-            
-            reading = generate_spectral_reading(freshness_level=freshness)
-            csv_line = format_csv_line(reading)
-            
-            csvfile.write(csv_line + "\n")
-            
-            # Add small delay to simulate real-time readings
-            time.sleep(0.01)
+    # Simulate milk degradation over time
+    # Start fresh and gradually spoil
+    rng = make_rng(seed)
+    freshness = np.maximum(0.1, 1.0 - (np.arange(num_samples) / num_samples) * 0.9)
+    
+    # Add some randomness
+    freshness += rng.normal(0, 0.1, num_samples)
+    np.clip(freshness, 0.0, 1.0, out=freshness)
+    
+    # Readings are already spaced 10 ms apart in timestamp_ms, no need to sleep
+    batch = generate_spectral_batch(freshness, rng)
+    write_csv_file(filename, SAMPLE_HEADER, batch)
     
     print(f"Sample data saved to {filename}")
 
@@ -140,73 +204,93 @@ def generate_realtime_stream(device_id="LACTEVA_001", duration_minutes=5):
     print(f"Generating real-time stream for {duration_minutes} minutes...")
     
     start_time = time.time()
-    end_time = start_time + (duration_minutes * 60)
+    start_ms = int(start_time * 1000)
+    start_ns = time.monotonic_ns()
+    interval_ns = REALTIME_INTERVAL_S * 1_000_000_000
+    duration_s = duration_minutes * 60
+    num_samples = int(np.ceil(duration_s / REALTIME_INTERVAL_S))
     
     filename = f"realtime_stream_{device_id}_{int(start_time)}.csv"
     
     with open(filename, 'w', newline='') as csvfile:
         csvfile.write("# LACTEVA Real-time Stream\n")
         csvfile.write(f"# Device: {device_id}\n")
-        csvfile.write(f"# Started: {datetime.now().isoformat()}\n")
+        csvfile.write(f"# Started: {datetime.fromtimestamp(start_time).isoformat()}\n")
         
-        sample_count = 0
-        while time.time() < end_time:
-            # Simulate gradual spoilage
-            elapsed = time.time() - start_time
-            freshness = max(0.2, 0.9 - (elapsed / (duration_minutes * 60)) * 0.3)
+        rng = make_rng()
+        last_progress_ns = 0
+        for sample_count in range(1, num_samples + 1):
+            # Simulate gradual spoilage, timed from the schedule rather than the clock
+            elapsed = (sample_count - 1) * REALTIME_INTERVAL_S
+            freshness = max(0.2, 0.9 - (elapsed / duration_s) * 0.3)
             
             # Add some noise and occasional spikes
-            if random.random() < 0.05:  # 5% chance of anomaly
-                freshness *= random.uniform(0.5, 1.5)
+            if rng.random() < 0.05:  # 5% chance of anomaly
+                freshness *= rng.uniform(0.5, 1.5)
             
             freshness = max(0.0, min(1.0, freshness))
             
-            reading = generate_spectral_reading(device_id, freshness)
-            csv_line = format_csv_line(reading)
+            reading = generate_spectral_reading(device_id, freshness, rng=rng,
+                                                timestamp_ms=start_ms + elapsed * 1000)
+            csvfile.write(format_csv_line(reading))
+            if sample_count % REALTIME_FLUSH_EVERY == 0:
+                csvfile.flush()  # Make buffered samples visible to readers
             
-            csvfile.write(csv_line + "\n")
-            csvfile.flush()  # Ensure data is written immediately
+            # Progress line, refreshed at most once per PROGRESS_INTERVAL_NS
+            now_ns = time.monotonic_ns()
+            if now_ns - last_progress_ns >= PROGRESS_INTERVAL_NS or sample_count == num_samples:
+                sys.stdout.write(PROGRESS_TEMPLATE % (sample_count, freshness))
+                sys.stdout.flush()
+                last_progress_ns = now_ns
             
-            sample_count += 1
-            print(f"\rSamples generated: {sample_count} | Freshness: {freshness:.2f}", end="")
-            
-            # Wait for next sample (simulate 30-second intervals)
-            time.sleep(30)
+            # Wait for next sample (simulate 30-second intervals), sleeping until the
+            # scheduled monotonic deadline so the time spent writing does not drift it
+            remaining_ns = start_ns + sample_count * interval_ns - time.monotonic_ns()
+            if remaining_ns > 0:
+                time.sleep(remaining_ns / 1e9)
     
     print(f"\nReal-time stream saved to {filename}")
 
-def main():
+def generate_historical_data(device, seed=None, num_samples=50):
+    """Generate historical data for one device with its own freshness pattern"""
+    print(f"\nGenerating data for {device}...")
+    
+    # Each device gets its own independent stream (a child SeedSequence from main)
+    rng = make_rng(seed)
+    filename = f"historical_{device}.csv"
+    
+    # Different spoilage patterns for each device
+    i = np.arange(num_samples)
+    if device == "LACTEVA_001":
+        freshness = 0.9 - (i / num_samples) * 0.6  # Gradual spoilage
+    elif device == "LACTEVA_002":
+        freshness = np.where(i < 30, 0.8, 0.3)  # Sudden spoilage
+    else:
+        freshness = 0.7 + 0.2 * np.sin(i / 10)  # Oscillating quality
+    
+    freshness += rng.normal(0, 0.05, num_samples)
+    np.clip(freshness, 0.1, 1.0, out=freshness)
+    
+    write_csv_file(filename, HISTORICAL_HEADER % device, generate_spectral_batch(freshness, rng))
+    
+    return filename
+
+def main(seed=SEED):
     """Main function to generate sample data"""
     print("LACTEVA Sample Data Generator")
     print("=" * 40)
     
-    # Generate static sample dataset
-    generate_sample_dataset("sample_readings.csv", 200)
-    
-    # Generate data for multiple devices
+    # One root seed, split into independent child streams for every generator
     devices = ["LACTEVA_001", "LACTEVA_002", "LACTEVA_003"]
+    sample_seed, *device_seeds = np.random.SeedSequence(seed).spawn(len(devices) + 1)
     
-    for device in devices:
-        print(f"\nGenerating data for {device}...")
-        
-        # Generate historical data with different freshness patterns
-        with open(f"historical_{device}.csv", 'w', newline='') as csvfile:
-            csvfile.write(f"# Historical data for {device}\n")
-            
-            for i in range(50):
-                # Different spoilage patterns for each device
-                if device == "LACTEVA_001":
-                    freshness = 0.9 - (i / 50) * 0.6  # Gradual spoilage
-                elif device == "LACTEVA_002":
-                    freshness = 0.8 if i < 30 else 0.3  # Sudden spoilage
-                else:
-                    freshness = 0.7 + 0.2 * math.sin(i / 10)  # Oscillating quality
-                
-                freshness = max(0.1, min(1.0, freshness + random.gauss(0, 0.05)))
-                
-                reading = generate_spectral_reading(device, freshness)
-                csv_line = format_csv_line(reading)
-                csvfile.write(csv_line + "\n")
+    # Generate static sample dataset
+    generate_sample_dataset("sample_readings.csv", 200, seed=sample_seed)
+    
+    # Generate data for multiple devices, one process per device
+    with ProcessPoolExecutor(max_workers=len(devices)) as executor:
+        for filename in executor.map(generate_historical_data, devices, device_seeds):
+            print(f"Historical data saved to {filename}")
     
     print("\n" + "=" * 40)
     print("Sample data generation complete!")
@@ -218,4 +302,6 @@ def main():
     print("\nUse these files to test the dashboard and API endpoints.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate LACTEVA sample data")
+    parser.add_argument("--seed", type=int, default=SEED, help="root random seed (default: %(default)s)")
+    main(parser.parse_args().seed)
\ No newline at end of file